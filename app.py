@@ -5,40 +5,105 @@ A Flask-SocketIO application that serves a web-based virtual Xbox controller
 and translates button presses to virtual gamepad inputs.
 """
 
-from flask import Flask, render_template, jsonify, send_from_directory, request, send_file
+from flask import Flask, render_template, jsonify, send_from_directory, request, Response
 from io import BytesIO
 from flask_socketio import SocketIO
+from werkzeug.middleware.proxy_fix import ProxyFix
 import vgamepad as vg
+import eventlet
+import eventlet.wsgi
+from eventlet import tpool
+from eventlet.green import ssl as green_ssl
+from eventlet.queue import LightQueue
+from collections import deque
+import qrcode
 import os
 import ssl
 import socket
 import signal
 import sys
 import atexit
+import functools
+import json
+import logging
+import logging.handlers
+import queue
+import argparse
+import datetime
+import ipaddress
+import subprocess
+import threading
+import time
+
+try:
+    import orjson  # Optional: faster JSON for Socket.IO packets and API responses
+except ImportError:
+    orjson = None
+
+try:
+    from whitenoise import WhiteNoise  # Optional: lighter-weight static file serving
+except ImportError:
+    WhiteNoise = None
+
+# Runtime events (client assignments, controller hotplug) are logged rather than
+# printed so they can be filtered and never block on stdout; see setup_logging()
+log = logging.getLogger('opencontroller')
 
 # Lazy initialization for gamepad (handles ViGEmBus connection issues)
 # Multi-controller support: up to 4 virtual gamepads
 gamepads = {}  # {controller_num: VX360Gamepad} for controller 1-4
 client_assignments = {}  # {session_id: controller_num}
+controller_clients = {num: set() for num in range(1, 5)}  # {controller_num: {session_id}}
 server_running = True
 connected_clients = set()  # Track connected controller clients
 
+# Queued report flushing: input handlers write a controller's live input state and
+# queue snapshots of it; the controller's update worker sends them in order from a
+# native thread (eventlet.tpool) so a slow ViGEmBus IOCTL never stalls the Socket.IO
+# loop. Every button edge gets its own snapshot, stick samples share one per interval
+UPDATE_INTERVAL = 1 / 120  # seconds; matches 120 Hz phone touch sampling
+input_reports = {}  # {controller_num: report struct} live input state, written by handlers
+pending_reports = {}  # {controller_num: deque of bytes} snapshots waiting to be sent
+open_reports = set()  # {controller_num} whose newest pending snapshot still takes stick samples
+update_wakeups = {}  # {controller_num: LightQueue} wakes that controller's worker
+last_reports = {}  # {controller_num: bytes} last report sent to the driver
+
+# Status broadcasts (controller_status, client_count) are debounced so connect
+# storms fan out once per window
+STATUS_DEBOUNCE = 0.05  # seconds
+status_broadcast_pending = False
+last_client_count_sent = None
+new_clients = set()  # {session_id} connected since the last flush; sent the current state then
+last_status_sent = {num: 0 for num in range(1, 5)}  # {controller_num: client count} as last broadcast
+
 
 def get_or_create_gamepad(controller_num):
     """Get or create the virtual gamepad for a specific controller slot (1-4)."""
     global gamepads
     
-    if controller_num < 1 or controller_num > 4:
+    # Fast path: the slot already has a gamepad (the common case on connect)
+    gp = gamepads.get(controller_num)
+    if gp is not None:
+        return gp
+    
+    if not 1 <= controller_num <= 4:
         return None
     
-    if controller_num not in gamepads:
-        try:
-            gamepads[controller_num] = vg.VX360Gamepad()
-            print(f"  ✓ Virtual Xbox 360 controller {controller_num} connected")
-        except Exception as e:
-            print(f"  ✗ Could not connect controller {controller_num} to ViGEmBus: {e}")
-            print("    Try: Restart the ViGEmBus service or reboot your PC")
-            return None
+    try:
+        gamepads[controller_num] = vg.VX360Gamepad()
+        log.info("✓ Virtual Xbox 360 controller %d connected", controller_num)
+    except Exception as e:
+        log.error("✗ Could not connect controller %d to ViGEmBus: %s", controller_num, e)
+        log.error("  Try: Restart the ViGEmBus service or reboot your PC")
+        return None
+    
+    report = gamepads[controller_num].report
+    input_reports[controller_num] = type(report).from_buffer_copy(report)
+    pending = deque()
+    pending_reports[controller_num] = pending
+    wakeup = LightQueue(maxsize=1)
+    update_wakeups[controller_num] = wakeup
+    socketio.start_background_task(update_worker, controller_num, pending, wakeup)
     
     return gamepads[controller_num]
 
@@ -47,25 +112,116 @@ def disconnect_gamepad(controller_num):
     """Disconnect a specific virtual gamepad if it exists."""
     global gamepads
     
+    open_reports.discard(controller_num)
+    last_reports.pop(controller_num, None)
+    input_reports.pop(controller_num, None)
+    pending_reports.pop(controller_num, None)
+    wakeup = update_wakeups.pop(controller_num, None)
+    if wakeup is not None and wakeup.empty():
+        wakeup.put_nowait(True)  # Let the worker notice the controller is gone
     if controller_num in gamepads:
         try:
             gamepads[controller_num].reset()
             gamepads[controller_num].update()
             del gamepads[controller_num]
-            print(f"  ✓ Virtual controller {controller_num} disconnected")
+            log.info("✓ Virtual controller %d disconnected", controller_num)
         except Exception as e:
-            print(f"  ✗ Error disconnecting controller {controller_num}: {e}")
+            log.error("✗ Error disconnecting controller %d: %s", controller_num, e)
+
+
+def send_report(controller_num, gp, report):
+    """Send a report snapshot to the driver, unless it matches the last one sent."""
+    if last_reports.get(controller_num) == report:
+        return  # e.g. repeated stick samples at rest
+    last_reports[controller_num] = report
+    # update() reads gp.report from the native thread, so give it its own copy
+    # that later input can't change mid-send
+    gp.report = type(gp.report).from_buffer_copy(report)
+    tpool.execute(gp.update)
+
+
+def request_update(controller_num, force=False):
+    """
+    Queue a snapshot of a controller's input state for its update worker.
+    With force=True the snapshot is queued on its own and sent without waiting;
+    otherwise it replaces a stick snapshot that is still waiting to go out.
+    """
+    pending = pending_reports.get(controller_num)
+    if pending is None:
+        return
+    report = bytes(input_reports[controller_num])
+    if force:
+        open_reports.discard(controller_num)
+    elif controller_num in open_reports:
+        pending[-1] = report  # Coalesce with the waiting stick snapshot
+        return
+    else:
+        open_reports.add(controller_num)
+    pending.append(report)
+    wakeup = update_wakeups[controller_num]
+    if wakeup.empty():
+        wakeup.put_nowait(True)
+
+
+def update_worker(controller_num, pending, wakeup):
+    """Per-controller loop sending queued reports, in order, off the event loop."""
+    while True:
+        wakeup.get()
+        while pending:
+            if len(pending) == 1 and controller_num in open_reports:
+                if not wakeup.empty():
+                    wakeup.get_nowait()  # Already covered by this pass over pending
+                # Let further stick samples coalesce; a button edge (or a
+                # disconnect) wakes the worker early so it goes out right away
+                try:
+                    wakeup.get(timeout=UPDATE_INTERVAL)
+                except queue.Empty:
+                    pass
+                if update_wakeups.get(controller_num) is not wakeup:
+                    return  # Controller was disconnected
+            if len(pending) == 1:
+                open_reports.discard(controller_num)  # Newest snapshot is leaving
+            report = pending.popleft()
+            
+            gp = gamepads.get(controller_num)
+            if gp is None or update_wakeups.get(controller_num) is not wakeup:
+                return  # Controller was disconnected
+            try:
+                send_report(controller_num, gp, report)
+            except Exception as e:
+                log.error("✗ Error updating controller %d: %s", controller_num, e)
+        
+        if update_wakeups.get(controller_num) is not wakeup:
+            return  # Controller was disconnected
+
 
+def reassign_client(sid, controller_num):
+    """
+    Move a client to a controller in both lookup tables in one step.
+    Returns the client's previous controller (None for a new client).
+    """
+    old_controller = client_assignments.get(sid)
+    if old_controller == controller_num:
+        return old_controller
+    if old_controller is not None:
+        controller_clients[old_controller].discard(sid)
+    client_assignments[sid] = controller_num
+    controller_clients[controller_num].add(sid)
+    return old_controller
 
-def get_clients_for_controller(controller_num):
-    """Get all client session IDs using a specific controller."""
-    return [sid for sid, num in client_assignments.items() if num == controller_num]
+
+def unassign_client(sid):
+    """Remove a client's controller assignment, returning the old controller."""
+    controller_num = client_assignments.pop(sid, None)
+    if controller_num is not None:
+        controller_clients[controller_num].discard(sid)
+    return controller_num
 
 
 def cleanup_unused_controllers():
     """Disconnect controllers that have no clients assigned."""
     for num in list(gamepads.keys()):
-        if not get_clients_for_controller(num):
+        if not controller_clients[num]:
             disconnect_gamepad(num)
 
 
@@ -95,6 +251,24 @@ def shutdown_server():
     print("  ✓ Server shutdown complete")
 
 
+def setup_logging():
+    """
+    Send runtime log records to stdout through a QueueListener thread, so
+    logging from Socket.IO handlers never waits on console writes.
+    """
+    log_queue = queue.SimpleQueue()
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter('  %(message)s'))
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    
+    log.addHandler(logging.handlers.QueueHandler(log_queue))
+    log.setLevel(logging.INFO)
+    log.propagate = False
+    
+    listener.start()
+    atexit.register(listener.stop)
+
+
 def signal_handler(sig, frame):
     """Handle shutdown signals (Ctrl+C, SIGTERM)."""
     print(f"\n  Received shutdown signal ({signal.Signals(sig).name})")
@@ -109,14 +283,81 @@ signal.signal(signal.SIGTERM, signal_handler)  # Termination signal
 # Register cleanup on normal exit
 atexit.register(cleanup_gamepad)
 
+class OrjsonCompat:
+    """Stdlib-compatible json module shim backed by orjson (for python-socketio)."""
+    
+    @staticmethod
+    def dumps(obj, **kwargs):
+        # Socket.IO payloads like controller_status use int keys
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+    
+    @staticmethod
+    def loads(data, **kwargs):
+        return orjson.loads(data)
+
+
+@functools.lru_cache(maxsize=4)
+def status_json(running, controller_connected):
+    """Serialize the /status body once per distinct server state."""
+    body = {
+        'running': running,
+        'controller_connected': controller_connected
+    }
+    if orjson is not None:
+        return orjson.dumps(body)
+    return json.dumps(body).encode()
+
+
 # Flask app configuration
 app = Flask(__name__)
-socketio = SocketIO(app, cors_allowed_origins="*")
+# Pin the eventlet server explicitly so a missing eventlet install fails loudly
+# instead of silently falling back to the threaded Werkzeug dev server
+socketio_options = {'json': OrjsonCompat} if orjson is not None else {}
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode='eventlet', **socketio_options)
+
+# Browser caching for static assets (seconds). Asset URLs are unversioned and the
+# service worker's fetches go through the HTTP cache too, so assets are always
+# revalidated; their ETags keep that to a cheap 304 instead of a full download
+STATIC_MAX_AGE = 0
+app.config['SEND_FILE_MAX_AGE_DEFAULT'] = STATIC_MAX_AGE
+
+
+def revalidate_static(headers, path, url):
+    """Mark WhiteNoise responses no-cache, as Flask's send_file does for max_age=0."""
+    headers['Cache-Control'] = 'no-cache'
+
+
+# Serve /static/* from WhiteNoise's in-memory file index when available, so
+# asset requests skip Flask routing entirely (Flask's static route otherwise)
+if WhiteNoise is not None:
+    app.wsgi_app = WhiteNoise(
+        app.wsgi_app,
+        root=os.path.join(os.path.dirname(__file__), 'static'),
+        prefix='static/',
+        max_age=STATIC_MAX_AGE,
+        add_headers_function=revalidate_static
+    )
 
 # SSL certificate paths
 CERT_DIR = os.path.join(os.path.dirname(__file__), 'certs')
 CERT_FILE = os.path.join(CERT_DIR, 'cert.pem')
 KEY_FILE = os.path.join(CERT_DIR, 'key.pem')
+CERT_LIFETIME = datetime.timedelta(days=365)
+CERT_RENEW_BEFORE = datetime.timedelta(days=30)  # Renew our own cert this close to expiry
+
+# Listening socket settings
+HOST = '0.0.0.0'
+PORT = 5000
+LISTEN_BACKLOG = 128
+
+# Loopback port used with --behind-proxy, where a TLS-terminating reverse proxy
+# (see Caddyfile) owns PORT and forwards plain HTTP here
+BACKEND_HOST = '127.0.0.1'
+BACKEND_PORT = 5001
+
+# "https" once a certificate is in place; resolved at startup since the cert
+# files don't change while the server is running
+PROTOCOL = "http"
 
 # Button mapping dictionary for cleaner input handling
 BUTTON_MAP = {
@@ -133,9 +374,27 @@ BUTTON_MAP = {
     'guide': vg.XUSB_BUTTON.XUSB_GAMEPAD_GUIDE,
 }
 
+# Wire order for index-based button events (must match BUTTON_INDEX in
+# static/js/controller.js); lets the hot path use a tuple lookup
+BUTTON_ORDER = ('a', 'b', 'x', 'y', 'up', 'down', 'left', 'right', 'start', 'back', 'guide')
+
+# Plain-int wButtons bits, so input handling can OR/AND them straight into the
+# report instead of going through press_button()/release_button()
+BUTTON_MASKS = tuple(int(BUTTON_MAP[name]) for name in BUTTON_ORDER)
+BUTTON_MASK_MAP = {name: int(button) for name, button in BUTTON_MAP.items()}
+
+# Thumbstick int16 range
+STICK_MAX = 32767
+STICK_MIN = -32768
 
+# Upper bound on events applied from one batched input message, so a runaway
+# client can't monopolize the event loop; the newest events (the final state) are kept
+MAX_BATCH_EVENTS = 64
+
+
+@functools.lru_cache(maxsize=1)
 def get_local_ip():
-    """Get the local IP address of this machine."""
+    """Get the local IP address of this machine (resolved once per run)."""
     try:
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         s.connect(("8.8.8.8", 80))
@@ -147,33 +406,21 @@ def get_local_ip():
 
 
 def generate_self_signed_cert():
-    """Generate a self-signed SSL certificate if it doesn't exist."""
-    if os.path.exists(CERT_FILE) and os.path.exists(KEY_FILE):
-        return True
+    """
+    Generate a self-signed SSL certificate if it doesn't exist, or renew our own
+    certificate when it is close to expiring. An existing private key is reused,
+    so only the very first run pays for key generation.
+    """
+    certs_exist = os.path.exists(CERT_FILE) and os.path.exists(KEY_FILE)
     
     try:
         from cryptography import x509
         from cryptography.x509.oid import NameOID
         from cryptography.hazmat.primitives import hashes
         from cryptography.hazmat.backends import default_backend
-        from cryptography.hazmat.primitives.asymmetric import rsa
+        from cryptography.hazmat.primitives.asymmetric import ec
         from cryptography.hazmat.primitives import serialization
-        import datetime
-        
-        # Create certs directory
-        os.makedirs(CERT_DIR, exist_ok=True)
         
-        # Generate private key
-        key = rsa.generate_private_key(
-            public_exponent=65537,
-            key_size=2048,
-            backend=default_backend()
-        )
-        
-        # Get local IP for certificate
-        local_ip = get_local_ip()
-        
-        # Create certificate
         subject = issuer = x509.Name([
             x509.NameAttribute(NameOID.COUNTRY_NAME, "US"),
             x509.NameAttribute(NameOID.STATE_OR_PROVINCE_NAME, "Local"),
@@ -181,35 +428,63 @@ def generate_self_signed_cert():
             x509.NameAttribute(NameOID.ORGANIZATION_NAME, "OpenController"),
             x509.NameAttribute(NameOID.COMMON_NAME, "OpenController"),
         ])
+        now = datetime.datetime.now(datetime.timezone.utc)
+        
+        if certs_exist:
+            with open(CERT_FILE, "rb") as f:
+                existing = x509.load_pem_x509_certificate(f.read(), default_backend())
+            # cryptography < 42 only offers the naive-UTC property
+            expires = getattr(existing, 'not_valid_after_utc', None)
+            if expires is None:
+                expires = existing.not_valid_after.replace(tzinfo=datetime.timezone.utc)
+            # Keep anything we didn't issue (e.g. mkcert certs) and anything
+            # that isn't about to expire
+            if existing.issuer != issuer or expires - now > CERT_RENEW_BEFORE:
+                return True
+        
+        # Create certs directory
+        os.makedirs(CERT_DIR, exist_ok=True)
+        
+        if os.path.exists(KEY_FILE):
+            # Reuse the existing private key
+            with open(KEY_FILE, "rb") as f:
+                key = serialization.load_pem_private_key(f.read(), password=None,
+                                                         backend=default_backend())
+        else:
+            # Generate private key (ECDSA P-256: milliseconds to generate, unlike
+            # RSA-2048, and accepted by every mobile browser, unlike Ed25519)
+            key = ec.generate_private_key(ec.SECP256R1(), default_backend())
+            
+            # Write key file
+            with open(KEY_FILE, "wb") as f:
+                f.write(key.private_bytes(
+                    encoding=serialization.Encoding.PEM,
+                    format=serialization.PrivateFormat.TraditionalOpenSSL,
+                    encryption_algorithm=serialization.NoEncryption()
+                ))
+        
+        # Get local IP for certificate
+        local_ip = get_local_ip()
+        san = x509.SubjectAlternativeName([
+            x509.DNSName("localhost"),
+            x509.DNSName(local_ip),
+            x509.IPAddress(ipaddress.IPv4Address(local_ip)),
+            x509.IPAddress(ipaddress.IPv4Address("127.0.0.1")),
+        ])
         
+        # Create certificate
         cert = (
             x509.CertificateBuilder()
             .subject_name(subject)
             .issuer_name(issuer)
             .public_key(key.public_key())
             .serial_number(x509.random_serial_number())
-            .not_valid_before(datetime.datetime.utcnow())
-            .not_valid_after(datetime.datetime.utcnow() + datetime.timedelta(days=365))
-            .add_extension(
-                x509.SubjectAlternativeName([
-                    x509.DNSName("localhost"),
-                    x509.DNSName(local_ip),
-                    x509.IPAddress(ipaddress.IPv4Address(local_ip)),
-                    x509.IPAddress(ipaddress.IPv4Address("127.0.0.1")),
-                ]),
-                critical=False,
-            )
+            .not_valid_before(now)
+            .not_valid_after(now + CERT_LIFETIME)
+            .add_extension(san, critical=False)
             .sign(key, hashes.SHA256(), default_backend())
         )
         
-        # Write key file
-        with open(KEY_FILE, "wb") as f:
-            f.write(key.private_bytes(
-                encoding=serialization.Encoding.PEM,
-                format=serialization.PrivateFormat.TraditionalOpenSSL,
-                encryption_algorithm=serialization.NoEncryption()
-            ))
-        
         # Write cert file
         with open(CERT_FILE, "wb") as f:
             f.write(cert.public_bytes(serialization.Encoding.PEM))
@@ -218,18 +493,20 @@ def generate_self_signed_cert():
         return True
         
     except ImportError:
+        if certs_exist:
+            return True  # Existing certificates work without cryptography
         print("  ✗ 'cryptography' package not installed.")
         print("    Install with: pip install cryptography")
         print("    Falling back to HTTP (PWA won't work as standalone app)")
         return False
     except Exception as e:
         print(f"  ✗ Failed to generate certificate: {e}")
-        return False
+        return certs_exist  # Keep serving existing certificates if renewal failed
 
 
+@functools.lru_cache(maxsize=1)
 def get_mkcert_ca_path():
-    """Find mkcert's root CA certificate path."""
-    import subprocess
+    """Find mkcert's root CA certificate path (looked up once per run)."""
     try:
         result = subprocess.run(['mkcert', '-CAROOT'], capture_output=True, text=True)
         if result.returncode == 0:
@@ -242,6 +519,90 @@ def get_mkcert_ca_path():
     return None
 
 
+@functools.lru_cache(maxsize=1)
+def get_mkcert_ca_pem():
+    """Read mkcert's root CA certificate once (None if mkcert isn't available)."""
+    ca_path = get_mkcert_ca_path()
+    if ca_path is None:
+        return None
+    with open(ca_path, 'rb') as f:
+        return f.read()
+
+
+@functools.lru_cache(maxsize=1)
+def get_server_url():
+    """
+    Build the URL phones use to reach the controller page.
+    The result is cached, so this must not be called before PROTOCOL is set
+    in __main__ (it would cache the default protocol for the whole run).
+    """
+    return f"{PROTOCOL}://{get_local_ip()}:{PORT}"
+
+
+# Shared QR encoder for the lobby codes. Low error correction keeps the codes
+# small for on-screen display; the 2-module border plus the lobby's white image
+# padding still leaves a scannable quiet zone.
+QR_CODE = qrcode.QRCode(
+    error_correction=qrcode.constants.ERROR_CORRECT_L,
+    box_size=6,
+    border=2
+)
+
+
+@functools.lru_cache(maxsize=2)
+def render_qr_png(url):
+    """Render a QR code for a URL to PNG bytes (cached, URLs are fixed per run)."""
+    QR_CODE.clear()
+    QR_CODE.add_data(url)
+    QR_CODE.make(fit=True)
+    
+    image = QR_CODE.make_image(fill_color='black', back_color='white')
+    buffer = BytesIO()
+    image.save(buffer, format='PNG', optimize=True)
+    return buffer.getvalue()
+
+
+def png_response(data):
+    """
+    Serve cached PNG bytes with ETag revalidation.
+    The QR URLs are fixed while the address they encode can change between
+    runs, so browsers must revalidate instead of caching them for a day.
+    """
+    response = Response(data, mimetype='image/png')
+    response.cache_control.no_cache = True
+    response.add_etag()
+    return response.make_conditional(request)
+
+
+def create_ssl_context():
+    """
+    Build the server's TLS context once, up front: TLS 1.2+, HTTP/1.1 via ALPN,
+    and OpenSSL's default session tickets so reconnecting phones resume their
+    session instead of repeating the full handshake.
+    """
+    context = green_ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.load_cert_chain(CERT_FILE, KEY_FILE)
+    context.set_alpn_protocols(['http/1.1'])
+    return context
+
+
+def create_listener(host, port, use_ssl):
+    """
+    Create the server's listening socket.
+    Accepted connections inherit TCP_NODELAY so small input packets are not
+    held back by Nagle's algorithm, and SO_KEEPALIVE so dead phones get reaped.
+    """
+    listener = eventlet.listen((host, port), backlog=LISTEN_BACKLOG)
+    listener.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    
+    if use_ssl:
+        listener = create_ssl_context().wrap_socket(listener, server_side=True)
+    
+    return listener
+
+
 # ============================================
 # Routes
 # ============================================
@@ -255,22 +616,25 @@ def index():
 @app.route('/manifest.json')
 def manifest():
     """Serve the PWA manifest from static folder."""
-    return send_from_directory('static', 'manifest.json', mimetype='application/json')
+    return send_from_directory('static', 'manifest.json', mimetype='application/json',
+                               max_age=STATIC_MAX_AGE)
 
 
 @app.route('/sw.js')
 def service_worker():
-    """Serve service worker from root path for proper scope."""
-    return send_from_directory('static', 'sw.js', mimetype='application/javascript')
+    """
+    Serve service worker from root path for proper scope.
+    Always revalidated (ETag) so clients pick up new versions immediately.
+    """
+    return send_from_directory('static', 'sw.js', mimetype='application/javascript',
+                               max_age=0)
 
 
 @app.route('/status')
 def status():
     """Return server status and controller state."""
-    return jsonify({
-        'running': server_running,
-        'controller_connected': gamepad is not None
-    })
+    return Response(status_json(server_running, bool(gamepads)),
+                    mimetype='application/json')
 
 
 @app.route('/offline')
@@ -294,11 +658,9 @@ def shutdown():
     
     # Schedule the actual server stop
     def stop_server():
-        import time
         time.sleep(0.5)  # Give time for response to be sent
         os._exit(0)
     
-    import threading
     threading.Thread(target=stop_server, daemon=True).start()
     
     return jsonify({'message': 'Server shutting down...'})
@@ -311,14 +673,11 @@ def shutdown():
 @app.route('/lobby')
 def lobby():
     """Serve the lobby dashboard for big screen display."""
-    local_ip = get_local_ip()
-    protocol = "https" if os.path.exists(CERT_FILE) else "http"
-    server_url = f"{protocol}://{local_ip}:5000"
     mkcert_available = get_mkcert_ca_path() is not None
     
     return render_template('lobby.html',
-        server_url=server_url,
-        local_ip=local_ip,
+        server_url=get_server_url(),
+        local_ip=get_local_ip(),
         mkcert_available=mkcert_available,
         client_count=len(connected_clients)
     )
@@ -326,48 +685,23 @@ def lobby():
 
 @app.route('/lobby/qr-join.png')
 def lobby_qr_join():
-    """Generate QR code for controller URL."""
-    import qrcode
-    
-    local_ip = get_local_ip()
-    protocol = "https" if os.path.exists(CERT_FILE) else "http"
-    url = f"{protocol}://{local_ip}:5000"
-    
-    qr = qrcode.make(url)
-    buffer = BytesIO()
-    qr.save(buffer, format='PNG')
-    buffer.seek(0)
-    
-    return send_file(buffer, mimetype='image/png')
+    """Serve QR code for controller URL."""
+    return png_response(render_qr_png(get_server_url()))
 
 
 @app.route('/lobby/qr-cert.png')
 def lobby_qr_cert():
-    """Generate QR code for certificate setup page."""
-    import qrcode
-    
-    local_ip = get_local_ip()
-    protocol = "https" if os.path.exists(CERT_FILE) else "http"
-    url = f"{protocol}://{local_ip}:5000/setup"
-    
-    qr = qrcode.make(url)
-    buffer = BytesIO()
-    qr.save(buffer, format='PNG')
-    buffer.seek(0)
-    
-    return send_file(buffer, mimetype='image/png')
+    """Serve QR code for certificate setup page."""
+    return png_response(render_qr_png(f"{get_server_url()}/setup"))
 
 
 @app.route('/setup')
 def setup():
     """Serve certificate setup page with download and instructions."""
-    local_ip = get_local_ip()
-    protocol = "https" if os.path.exists(CERT_FILE) else "http"
-    server_url = f"{protocol}://{local_ip}:5000"
     mkcert_available = get_mkcert_ca_path() is not None
     
     return render_template('setup.html',
-        server_url=server_url,
+        server_url=get_server_url(),
         mkcert_available=mkcert_available
     )
 
@@ -375,9 +709,12 @@ def setup():
 @app.route('/setup/ca.pem')
 def setup_ca():
     """Download mkcert root CA certificate."""
-    ca_path = get_mkcert_ca_path()
-    if ca_path:
-        return send_file(ca_path, as_attachment=True, download_name='rootCA.pem')
+    ca_pem = get_mkcert_ca_pem()
+    if ca_pem:
+        return Response(ca_pem, mimetype='application/x-pem-file', headers={
+            'Content-Disposition': 'attachment; filename=rootCA.pem',
+            'Cache-Control': 'public, max-age=3600'
+        })
     return jsonify({'error': 'mkcert not installed or CA not found'}), 404
 
 
@@ -385,22 +722,70 @@ def setup_ca():
 # Socket.IO Event Handlers
 # ============================================
 
-def broadcast_controller_status():
-    """Broadcast which controllers are currently in use."""
-    status = {
-        num: len(get_clients_for_controller(num)) 
-        for num in range(1, 5)
-    }
-    socketio.emit('controller_status', status)
+# Constant controller_assigned replies for successful selections, built once
+ASSIGNED_OK = {num: {'controller': num, 'success': True} for num in range(1, 5)}
+
+
+def get_controller_status():
+    """Snapshot of how many clients use each controller slot."""
+    return {num: len(sids) for num, sids in controller_clients.items()}
+
+
+def broadcast_controller_status(new_sids=()):
+    """
+    Broadcast changes in controller usage as one small delta per changed slot.
+    Clients that connected during the window get the full snapshot instead.
+    """
+    status = get_controller_status()
+    for num, count in status.items():
+        if last_status_sent.get(num) != count:
+            last_status_sent[num] = count
+            socketio.emit('controller_status_delta', {'controller': num, 'count': count},
+                          skip_sid=list(new_sids))
+    for sid in new_sids:
+        socketio.emit('controller_status', status, to=sid)
+
+
+def broadcast_client_count(new_sids=()):
+    """
+    Broadcast the connected client count, unless clients already have it.
+    Clients that connected during the window get it either way.
+    """
+    global last_client_count_sent
+    count = len(connected_clients)
+    if count != last_client_count_sent:
+        last_client_count_sent = count
+        socketio.emit('client_count', count)
+        return
+    # e.g. a disconnect and reconnect within one window
+    for sid in new_sids:
+        socketio.emit('client_count', count, to=sid)
+
+
+def schedule_status_broadcast():
+    """Coalesce status broadcasts so a burst of (re)connects emits only once."""
+    global status_broadcast_pending
+    if status_broadcast_pending:
+        return
+    status_broadcast_pending = True
+    socketio.start_background_task(flush_status_broadcast)
+
+
+def flush_status_broadcast():
+    """Emit the pending status broadcasts after the debounce window."""
+    global status_broadcast_pending
+    socketio.sleep(STATUS_DEBOUNCE)
+    status_broadcast_pending = False
+    new_sids = new_clients & connected_clients
+    new_clients.clear()
+    broadcast_client_count(new_sids)
+    broadcast_controller_status(new_sids)
 
 
 def get_next_available_controller():
     """Find the next available controller slot (1-4), preferring empty slots."""
-    for num in range(1, 5):
-        if not get_clients_for_controller(num):
-            return num
     # All slots have at least one client, return slot 1 as default
-    return 1
+    return next((num for num, sids in controller_clients.items() if not sids), 1)
 
 
 @socketio.on('connect')
@@ -408,11 +793,10 @@ def handle_connect():
     """Track client connections and auto-assign to next available controller."""
     sid = request.sid
     connected_clients.add(sid)
-    socketio.emit('client_count', len(connected_clients))
     
     # Auto-assign to next available controller slot
     next_controller = get_next_available_controller()
-    client_assignments[sid] = next_controller
+    reassign_client(sid, next_controller)
     
     # Create the gamepad for this controller if it doesn't exist
     gp = get_or_create_gamepad(next_controller)
@@ -425,11 +809,13 @@ def handle_connect():
         'auto_assigned': True
     }, to=sid)
     
-    # Broadcast updated controller status to all clients
-    broadcast_controller_status()
+    # Everyone gets the (debounced) changes; the new client gets the full status
+    # and client count as of the end of the window
+    new_clients.add(sid)
+    schedule_status_broadcast()
     
     if success:
-        print(f"  Client {sid[:8]}... auto-assigned to controller {next_controller}")
+        log.info("Client %s... auto-assigned to controller %d", sid[:8], next_controller)
 
 
 @socketio.on('disconnect')
@@ -438,15 +824,14 @@ def handle_disconnect():
     connected_clients.discard(request.sid)
     
     # Get the controller this client was using
-    old_controller = client_assignments.pop(request.sid, None)
+    old_controller = unassign_client(request.sid)
     
     # Cleanup unused controller if no other clients are using it
     if old_controller is not None:
-        if not get_clients_for_controller(old_controller):
+        if not controller_clients[old_controller]:
             disconnect_gamepad(old_controller)
     
-    socketio.emit('client_count', len(connected_clients))
-    broadcast_controller_status()
+    schedule_status_broadcast()
 
 
 @socketio.on('select_controller')
@@ -456,50 +841,97 @@ def handle_select_controller(data):
     controller_num = data.get('controller', 1)
     
     # Validate controller number
-    if controller_num < 1 or controller_num > 4:
+    if not 1 <= controller_num <= 4:
         controller_num = 1
     
-    # Get old assignment
-    old_controller = client_assignments.get(sid)
+    # Move the client to the new controller
+    old_controller = reassign_client(sid, controller_num)
     
     # If already assigned to the requested controller, do nothing
     if old_controller == controller_num:
-        socketio.emit('controller_assigned', {
-            'controller': controller_num,
-            'success': True
-        }, to=sid)
+        socketio.emit('controller_assigned', ASSIGNED_OK[controller_num], to=sid)
         return
     
-    # Remove old assignment
-    if old_controller is not None:
-        del client_assignments[sid]
-        # Cleanup old controller if no one else is using it
-        if not get_clients_for_controller(old_controller):
-            disconnect_gamepad(old_controller)
-    
-    # Assign new controller
-    client_assignments[sid] = controller_num
+    # Cleanup old controller if no one else is using it
+    if old_controller is not None and not controller_clients[old_controller]:
+        disconnect_gamepad(old_controller)
     
     # Create the gamepad for this controller if it doesn't exist
     gp = get_or_create_gamepad(controller_num)
     success = gp is not None
     
     # Notify client of assignment result
-    socketio.emit('controller_assigned', {
+    socketio.emit('controller_assigned', ASSIGNED_OK[controller_num] if success else {
         'controller': controller_num,
-        'success': success
+        'success': False
     }, to=sid)
     
-    # Broadcast updated controller status to all clients
-    broadcast_controller_status()
+    # Broadcast updated controller status to all clients (debounced)
+    schedule_status_broadcast()
     
     if success:
-        print(f"  Client {sid[:8]}... assigned to controller {controller_num}")
+        log.info("Client %s... assigned to controller %d", sid[:8], controller_num)
+
+
+def apply_input(report, data):
+    """
+    Apply a single button or stick event to a controller's input report.
+    The report is written directly, as vgamepad's setters would.
+    Returns the event type that was applied, or None if it was ignored.
+    """
+    get = data.get
+    input_type = get('type', 'button')
+    
+    # Stick samples outnumber button edges by far, so test for them first
+    if input_type == 'stick':
+        # Handle thumbstick input (-1.0 to 1.0)
+        x = get('x', 0)
+        y = -get('y', 0)  # Invert Y axis (up is negative in web)
+        
+        # Convert to int16 range, saturating at the ends; |v| < 1 always fits
+        stick_x = STICK_MAX if x >= 1 else STICK_MIN if x <= -1 else int(x * STICK_MAX)
+        stick_y = STICK_MAX if y >= 1 else STICK_MIN if y <= -1 else int(y * STICK_MAX)
+        
+        # Resting or pinned sticks repeat the same quantized sample; the report
+        # already holds the last one, so skip waking the update worker
+        if report.sThumbLX == stick_x and report.sThumbLY == stick_y:
+            return None
+        
+        report.sThumbLX = stick_x
+        report.sThumbLY = stick_y
+        return 'stick'
+    
+    elif input_type == 'button':
+        btn = get('button')
+        pressed = get('pressed', False)
+        
+        # Clients send the button's BUTTON_ORDER index; names are still
+        # accepted for older cached clients
+        if type(btn) is int:
+            mask = BUTTON_MASKS[btn] if 0 <= btn < len(BUTTON_MASKS) else None
+        else:
+            mask = BUTTON_MASK_MAP.get(btn)
+        if mask is None:
+            return None  # Unknown button, ignore
+        
+        # Press or release the mapped button bit in the report
+        if pressed:
+            report.wButtons |= mask
+        else:
+            report.wButtons &= ~mask
+        return 'button'
+    
+    return None
 
 
 @socketio.on('input')
 def handle_input(data):
-    """Handle input from web client (buttons and thumbstick)."""
+    """
+    Handle input from web client (buttons and thumbstick).
+    Accepts a single event or a {'type': 'batch', 'events': [...]} bundle,
+    which is applied in order. Every button edge is sent to the driver as its
+    own report; stick samples are coalesced.
+    """
     sid = request.sid
     
     # Get this client's assigned controller
@@ -507,44 +939,35 @@ def handle_input(data):
     if controller_num is None:
         return  # Client hasn't selected a controller yet
     
-    # Get the gamepad for this controller
-    gp = gamepads.get(controller_num)
-    if gp is None:
+    # Get the input report for this controller
+    report = input_reports.get(controller_num)
+    if report is None:
         return  # Gamepad not available
     
-    input_type = data.get('type', 'button')
-    
-    if input_type == 'button':
-        btn = data.get('button')
-        pressed = data.get('pressed', False)
-        
-        # Look up button in mapping dictionary
-        xbox_button = BUTTON_MAP.get(btn)
-        if xbox_button is None:
-            return  # Unknown button, ignore
-        
-        # Press or release the mapped button
-        if pressed:
-            gp.press_button(button=xbox_button)
-        else:
-            gp.release_button(button=xbox_button)
+    if data.get('type') == 'batch':
+        events = data.get('events')
+        if not isinstance(events, list):
+            return  # Malformed batch, ignore
+        events = events[-MAX_BATCH_EVENTS:]
+    else:
+        events = (data,)
     
-    elif input_type == 'stick':
-        # Handle thumbstick input (-1.0 to 1.0)
-        x = data.get('x', 0)
-        y = data.get('y', 0)
-        
-        # Convert to int16 range (-32768 to 32767)
-        stick_x = int(x * 32767)
-        stick_y = int(-y * 32767)  # Invert Y axis (up is negative in web)
-        
-        # Clamp values
-        stick_x = max(-32768, min(32767, stick_x))
-        stick_y = max(-32768, min(32767, stick_y))
-        
-        gp.left_joystick(x_value=stick_x, y_value=stick_y)
+    stick_moved = False
+    for event in events:
+        if not isinstance(event, dict):
+            continue  # Malformed event, ignore
+        applied = apply_input(report, event)
+        if applied == 'button':
+            # Button edges are rare and latency-sensitive; queue each one so a
+            # quick tap's press and release both reach the driver
+            request_update(controller_num, force=True)
+            stick_moved = False  # The edge's snapshot carries the stick too
+        elif applied == 'stick':
+            stick_moved = True
     
-    gp.update()
+    if stick_moved:
+        # Stick samples arrive at touchmove rate, coalesce them per tick
+        request_update(controller_num)
 
 
 # ============================================
@@ -552,8 +975,13 @@ def handle_input(data):
 # ============================================
 
 if __name__ == '__main__':
-    import ipaddress
+    parser = argparse.ArgumentParser(description="OpenController - Virtual Xbox Controller")
+    parser.add_argument('--behind-proxy', action='store_true',
+                        help=f"serve plain HTTP on {BACKEND_HOST}:{BACKEND_PORT} and leave TLS "
+                             f"on port {PORT} to a reverse proxy (see Caddyfile)")
+    args = parser.parse_args()
     
+    setup_logging()
     local_ip = get_local_ip()
     
     print("=" * 50)
@@ -561,19 +989,27 @@ if __name__ == '__main__':
     print("=" * 50)
     print("\n  Generating SSL certificate...")
     
+    # generate_self_signed_cert() already reports whether cert and key exist
     use_ssl = generate_self_signed_cert()
+    PROTOCOL = "https" if use_ssl else "http"
     mkcert_available = get_mkcert_ca_path() is not None
     
-    if use_ssl:
-        protocol = "https"
+    if args.behind_proxy and not use_ssl:
+        # The Caddyfile terminates TLS with certs/cert.pem and certs/key.pem
+        print(f"\n  ✗ --behind-proxy needs certs/cert.pem and certs/key.pem for the TLS proxy")
+        print(f"      Install 'cryptography' (pip install cryptography) and try again")
+        sys.exit(1)
+    
+    if args.behind_proxy:
+        print(f"\n  🔀 Behind proxy: serving HTTP on {BACKEND_HOST}:{BACKEND_PORT}")
+        print(f"      Start the TLS proxy on port {PORT} with: caddy run")
+    elif use_ssl:
         print(f"\n  🔒 HTTPS enabled (self-signed certificate)")
         print(f"\n  ⚠️  First time: Accept the security warning on your phone")
-    else:
-        protocol = "http"
     
     print(f"\n  ─────────────────────────────────────────────")
-    print(f"  📱 Controller:  {protocol}://{local_ip}:5000")
-    print(f"  🖥️  Lobby:       {protocol}://{local_ip}:5000/lobby")
+    print(f"  📱 Controller:  {PROTOCOL}://{local_ip}:{PORT}")
+    print(f"  🖥️  Lobby:       {PROTOCOL}://{local_ip}:{PORT}/lobby")
     print(f"  ─────────────────────────────────────────────")
     
     if mkcert_available:
@@ -583,20 +1019,20 @@ if __name__ == '__main__':
         print(f"      choco install mkcert  OR  scoop install mkcert")
         print(f"      Then run: mkcert -install")
     
+    # Render the lobby QR codes now so the first lobby load serves cached bytes
+    render_qr_png(get_server_url())
+    render_qr_png(f"{get_server_url()}/setup")
+    
     print("\n  Press Ctrl+C to stop\n")
     
-    if use_ssl:
-        socketio.run(
-            app, 
-            host='0.0.0.0', 
-            port=5000,
-            certfile=CERT_FILE,
-            keyfile=KEY_FILE
-        )
+    if args.behind_proxy:
+        # Trust the proxy's X-Forwarded-* headers so request.remote_addr is the
+        # real client again (the localhost-only /shutdown check relies on it)
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1)
+        listener = create_listener(BACKEND_HOST, BACKEND_PORT, use_ssl=False)
     else:
-        socketio.run(
-            app, 
-            host='0.0.0.0', 
-            port=5000
-        )
-
+        listener = create_listener(HOST, PORT, use_ssl)
+    
+    # Serve through our own listener (instead of socketio.run) so TCP_NODELAY
+    # and SO_KEEPALIVE apply to every client connection
+    eventlet.wsgi.server(listener, app, log_output=False)
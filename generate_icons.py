@@ -1,14 +1,22 @@
 """Generate PNG icons from SVG for PWA."""
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 # Create images directory
 os.makedirs('static/images', exist_ok=True)
 
+# Output icons as (size, filename)
+ICONS = [
+    (192, 'static/images/icon-192.png'),
+    (512, 'static/images/icon-512.png'),
+    (180, 'static/images/apple-touch-icon.png'),
+]
+
 try:
     from PIL import Image, ImageDraw
     
-    def create_icon(size, filename):
-        """Create a simple controller icon."""
+    def render_master(size=512):
+        """Draw the controller icon once at full resolution."""
         img = Image.new('RGBA', (size, size), '#1a1a1a')
         draw = ImageDraw.Draw(img)
         
@@ -48,14 +56,20 @@ try:
         
         # Convert to RGB (no transparency for iOS)
         rgb_img = Image.new('RGB', (size, size), '#1a1a1a')
-        rgb_img.paste(img, mask=img.split()[3] if img.mode == 'RGBA' else None)
-        rgb_img.save(filename, 'PNG')
+        rgb_img.paste(img, mask=img.split()[3])
+        return rgb_img
+    
+    def save_resized(master, size, filename):
+        """Downscale the master icon and save it as PNG."""
+        icon = master if master.size == (size, size) else master.resize((size, size), Image.LANCZOS)
+        icon.save(filename, 'PNG', optimize=True)
         print(f'Created {filename}')
     
-    # Create all required sizes
-    create_icon(192, 'static/images/icon-192.png')
-    create_icon(512, 'static/images/icon-512.png')
-    create_icon(180, 'static/images/apple-touch-icon.png')
+    # Draw once, then resize and encode all sizes in parallel
+    # (Pillow releases the GIL while resampling and compressing)
+    master = render_master(max(size for size, _ in ICONS))
+    with ThreadPoolExecutor(max_workers=len(ICONS)) as pool:
+        list(pool.map(lambda icon: save_resized(master, *icon), ICONS))
     
     print('\n✓ All icons generated successfully!')
     
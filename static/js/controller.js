@@ -11,7 +11,8 @@ const state = {
     activeTouches: new Map(), // specialized map for button touches
     wakeLockEnabled: true,
     wakeLock: null,
-    selectedController: parseInt(localStorage.getItem('selectedController')) || 1
+    selectedController: parseInt(localStorage.getItem('selectedController')) || 1,
+    controllerStatus: {} // {controller: client count}
 };
 
 // DOM Elements
@@ -215,6 +216,41 @@ els.inputModeToggle.addEventListener('change', (e) => {
     toggleInputMode(e.target.checked);
 });
 
+// ============================================
+// Input Batching
+// ============================================
+
+// Stick samples are coalesced to one per animation frame; button edges are
+// sent immediately together with any pending stick sample as one batch
+let pendingStick = null;
+let stickFrameRequested = false;
+
+function flushInput(buttonEvent) {
+    const events = [];
+    if (pendingStick) {
+        events.push(pendingStick);
+        pendingStick = null;
+    }
+    if (buttonEvent) events.push(buttonEvent);
+
+    if (events.length === 1) {
+        socket.emit('input', events[0]);
+    } else if (events.length > 1) {
+        socket.emit('input', { type: 'batch', events });
+    }
+}
+
+function queueStick(x, y) {
+    pendingStick = { type: 'stick', x, y };
+    if (!stickFrameRequested) {
+        stickFrameRequested = true;
+        requestAnimationFrame(() => {
+            stickFrameRequested = false;
+            flushInput(null);
+        });
+    }
+}
+
 // ============================================
 // Floating Joystick Logic
 // ============================================
@@ -313,8 +349,8 @@ function updateStickLogic(clientX, clientY) {
 
     updateStickVisuals(stickCenter.x + visX, stickCenter.y + visY);
 
-    // Emit
-    socket.emit('input', { type: 'stick', x: normX, y: normY });
+    // Emit (coalesced per frame)
+    queueStick(normX, normY);
 }
 
 function updateStickVisuals(knobX, knobY) {
@@ -333,7 +369,7 @@ function updateStickVisuals(knobX, knobY) {
 function resetStick() {
     stickTouchId = null;
     els.thumbstickLayer.classList.remove('active');
-    socket.emit('input', { type: 'stick', x: 0, y: 0 });
+    queueStick(0, 0);
     haptics.tap(); // Release click
 }
 
@@ -341,11 +377,18 @@ function resetStick() {
 // Button Handling (Multi-touch)
 // ============================================
 
+// Wire indices for buttons (must match BUTTON_ORDER in app.py)
+const BUTTON_INDEX = {
+    a: 0, b: 1, x: 2, y: 3,
+    up: 4, down: 5, left: 6, right: 7,
+    start: 8, back: 9, guide: 10
+};
+
 function initButtons() {
     const buttons = document.querySelectorAll('.action-btn, .dpad-btn, .system-btn');
 
     buttons.forEach(btn => {
-        const key = btn.dataset.key;
+        const key = BUTTON_INDEX[btn.dataset.key];
 
         btn.addEventListener('touchstart', (e) => {
             e.preventDefault(); // Prevent scroll/zoom
@@ -370,7 +413,7 @@ function initButtons() {
 }
 
 function emitBtn(key, pressed) {
-    socket.emit('input', { type: 'button', button: key, pressed });
+    flushInput({ type: 'button', button: key, pressed });
 }
 
 // ============================================
@@ -415,12 +458,19 @@ socket.on('controller_assigned', (data) => {
     }
 });
 
-// Handle controller status updates (which controllers are in use)
+// Handle controller status (which controllers are in use): a full snapshot
+// on connect, then per-slot deltas as clients join, leave, or switch
 socket.on('controller_status', (status) => {
-    console.log('Controller status:', status);
+    state.controllerStatus = status;
+    console.log('Controller status:', state.controllerStatus);
     // Could be used to show which controllers are in use in the UI
 });
 
+socket.on('controller_status_delta', (delta) => {
+    state.controllerStatus[delta.controller] = delta.count;
+    console.log('Controller status:', state.controllerStatus);
+});
+
 socket.on('disconnect', () => {
     els.status.className = 'disconnected';
     els.statusText.textContent = 'OFFLINE';
@@ -453,4 +503,4 @@ if (els.controllerSelect) {
 // Initialize
 initJoystick();
 initButtons();
-console.log('OpenController Cyber v4.0 Initialized - Multi-Controller Support');
+console.log('OpenController Cyber v4.1 Initialized - Multi-Controller Support');
@@ -1,4 +1,4 @@
-const CACHE_NAME = 'opencontroller-v4';
+const CACHE_NAME = 'opencontroller-v6';
 const ASSETS = [
     '/',
     '/static/manifest.json',